@@ -9,34 +9,43 @@ I run this before any deployment so I always have a known-good config
 I can roll back to if needed.
 """
 
+import argparse
+import asyncio
 import sys
-from datetime import datetime
-from common import load_inventory, connect, BACKUP_DIR
+from common import load_inventory, connect_from_vars, fetch_running, save_backup, backup_stamp
 
 
-def backup_device(name: str, host: str) -> str:
-    conn = connect(host)
+def backup_device(name: str, conn, stamp: str) -> str:
+    return str(save_backup(name, fetch_running(conn), stamp))
+
+
+def _backup_one(name: str, vars: dict, stamp: str) -> str:
     try:
-        output = conn.send_command("show configuration commands", use_textfsm=False)
-        stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
-        filename = BACKUP_DIR / f"{name}.{stamp}.show"
-        filename.write_text(output)
-        return str(filename)
-    finally:
-        conn.disconnect()
-
-
-def main():
-    devices = load_inventory()
-    for name, vars in devices.items():
-        host = vars["host"]
+        conn = connect_from_vars(vars)
         try:
-            path = backup_device(name, host)
-            print(f"[{name}] backup saved to {path}")
-        except Exception as e:
-            print(f"[{name}] backup failed: {e}")
+            path = backup_device(name, conn, stamp)
+        finally:
+            conn.disconnect()
+        return f"[{name}] backup saved to {path}"
+    except Exception as e:
+        return f"[{name}] backup failed: {e}"
+
+
+async def main():
+    # Netmiko is blocking, so each device runs in a worker thread; wall time
+    # is the slowest device rather than the sum of all of them.
+    parser = argparse.ArgumentParser(description="Back up running configs")
+    parser.add_argument("--rebuild-cache", action="store_true",
+                        help="drop the cached inventory and reload the source file")
+    args = parser.parse_args()
+
+    devices = load_inventory(rebuild_cache=args.rebuild_cache)
+    stamp = backup_stamp()
+    tasks = [asyncio.to_thread(_backup_one, name, vars, stamp) for name, vars in devices.items()]
+    for fut in asyncio.as_completed(tasks):
+        print(await fut)
     return 0
 
 
 if __name__ == "__main__":
-    sys.exit(main())
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+"""
+Pre-build the JSON inventory cache (.cache/inventory.json) so later
+scripts in the same run skip YAML parsing entirely.
+"""
+
+import sys
+from common import INV_FILE, INV_CACHE, build_inventory_cache
+
+def main():
+    devices = build_inventory_cache(INV_FILE)
+    print(f"Cached {len(devices)} devices from {INV_FILE} in {INV_CACHE}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
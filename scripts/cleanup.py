@@ -16,16 +16,20 @@ bkp_days = int(os.getenv("BACKUP_RETENTION_DAYS", "30"))
 def purge_older_than(folder: Path, days: int):
     if not folder.exists():
         return 0
-    cutoff = datetime.now() - timedelta(days=days)
+    # Compare raw timestamps. scandir gives the file type from the directory
+    # read (d_type), so only the mtime still costs one lstat per entry.
+    cutoff_ts = (datetime.now() - timedelta(days=days)).timestamp()
     removed = 0
-    for p in folder.iterdir():
-        try:
-            mtime = datetime.fromtimestamp(p.stat().st_mtime)
-            if mtime < cutoff:
-                p.unlink()
-                removed += 1
-        except Exception:
-            pass
+    with os.scandir(folder) as it:
+        for entry in it:
+            try:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                if entry.stat(follow_symlinks=False).st_mtime < cutoff_ts:
+                    os.unlink(entry.path)
+                    removed += 1
+            except Exception:
+                pass
     return removed
 
 def main():
@@ -1,24 +1,34 @@
 #!/usr/bin/env python3
+import functools
+import json
 import os
 import pathlib
-import yaml
+import pickle
+import re
+import secrets
+from datetime import datetime, timezone
 from dotenv import load_dotenv
-from netmiko import ConnectHandler
-from jinja2 import Environment, FileSystemLoader
+
+# yaml, jinja2 and netmiko are imported where first used, so e.g. a
+# render-only run never loads netmiko.
 
 from logging_config import setup_logging  # <— new import
 
 ROOT = pathlib.Path(__file__).resolve().parents[1]
 INV_FILE = ROOT / "inventory" / "lab.yml"
+INV_JSON = INV_FILE.with_suffix(".json")  # optional export, see yml_to_json.py
 TEMPLATES = ROOT / "templates"
 OUT_DIR = ROOT / "configs_generated"
 LOG_DIR = ROOT / "logs"
 BACKUP_DIR = ROOT / "backups"
+CACHE_DIR = ROOT / ".cache"
+INV_CACHE = CACHE_DIR / "inventory.json"
 
 # Ensure dirs exist
 OUT_DIR.mkdir(exist_ok=True)
 LOG_DIR.mkdir(exist_ok=True)
 BACKUP_DIR.mkdir(exist_ok=True)
+CACHE_DIR.mkdir(exist_ok=True)
 
 load_dotenv(ROOT / ".env")
 
@@ -34,39 +44,306 @@ LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 logger = setup_logging(LOG_DIR, LOG_LEVEL)
 logger.info("Common initialized (inventory=%s)", INV_FILE)
 
-def load_inventory() -> dict:
-    with open(INV_FILE, "r") as f:
-        data = yaml.safe_load(f)
+def parse_inventory_yaml(path: pathlib.Path) -> dict:
+    import yaml
+    try:  # libyaml-backed loader is much faster than the pure-Python one
+        from yaml import CSafeLoader as SafeLoader
+    except ImportError:
+        from yaml import SafeLoader
+        logger.warning("libyaml not installed; inventory load will be slow")
+    with open(path, "r") as f:
+        data = yaml.load(f, Loader=SafeLoader)
     return data["devices"]
 
+def build_inventory_cache(path: pathlib.Path = INV_FILE) -> dict:
+    """Parse the YAML inventory and store it as JSON, stamped with its mtime."""
+    mtime_ns = path.stat().st_mtime_ns
+    devices = parse_inventory_yaml(path)
+    # Best effort: a read-only checkout or YAML-only types (e.g. dates) just
+    # mean no cache, never a failed load.
+    try:
+        blob = json.dumps({"source": str(path), "mtime_ns": mtime_ns, "devices": devices})
+        # JSON turns e.g. int mapping keys into strings; a cache hit must
+        # return exactly what the YAML parse did
+        if json.loads(blob)["devices"] != devices:
+            raise ValueError("inventory does not round-trip through JSON")
+        tmp = INV_CACHE.with_suffix(".json.tmp")
+        tmp.write_text(blob)
+        os.replace(tmp, INV_CACHE)
+    except (OSError, TypeError, ValueError) as e:
+        logger.debug("Inventory cache not written (%s)", e)
+    return devices
+
+@functools.lru_cache(maxsize=None)
+def _load(path: pathlib.Path, mtime_ns: int) -> dict:
+    # mtime_ns is only part of the cache key: editing the file invalidates it.
+    # Across processes, the JSON cache (much faster to parse than YAML) is
+    # used as long as it was built from this exact version of the file.
+    if path.suffix == ".json":
+        return json.loads(path.read_bytes())["devices"]
+    try:
+        cached = json.loads(INV_CACHE.read_bytes())
+        if cached["source"] == str(path) and cached["mtime_ns"] == mtime_ns:
+            return cached["devices"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return build_inventory_cache(path)
+
+def _inventory_source() -> tuple[pathlib.Path, int]:
+    # lab.json is used only while it is strictly newer than lab.yml, so editing
+    # the YAML without re-exporting (or equal mtimes after a fresh checkout)
+    # can never serve stale devices.
+    try:
+        json_mtime = INV_JSON.stat().st_mtime_ns
+    except FileNotFoundError:
+        return INV_FILE, INV_FILE.stat().st_mtime_ns
+    try:
+        yml_mtime = INV_FILE.stat().st_mtime_ns
+    except FileNotFoundError:
+        return INV_JSON, json_mtime
+    return (INV_JSON, json_mtime) if json_mtime > yml_mtime else (INV_FILE, yml_mtime)
+
+def load_inventory(rebuild_cache: bool = False) -> dict:
+    """Parsed devices from INV_FILE (or a newer INV_JSON); re-parsed only when the file changes."""
+    if rebuild_cache:
+        _load.cache_clear()
+        INV_CACHE.unlink(missing_ok=True)
+    return _load(*_inventory_source())
+
+# Connection settings shared by every device; only host/port vary per call
+_SSH_KEY_EXPANDED = os.path.expanduser(SSH_KEY) if SSH_KEY else ""
+
+_BASE_PARAMS = {
+    "device_type": "vyos",
+    "username": USERNAME,
+    "timeout": COMMAND_TIMEOUT,
+    "global_delay_factor": 1,
+    **({"use_keys": True, "key_file": _SSH_KEY_EXPANDED} if SSH_KEY else {"password": PASSWORD}),
+}
+
+_ASYNCSSH_BASE_PARAMS = {
+    "username": USERNAME,
+    "known_hosts": None,  # same as Netmiko: lab devices, no host key pinning
+    "connect_timeout": COMMAND_TIMEOUT,
+    **({"client_keys": [_SSH_KEY_EXPANDED]} if SSH_KEY else {"password": PASSWORD}),
+}
+
 def conn_params_from_vars(vars: dict) -> dict:
-    params = {
-        "device_type": "vyos",
-        "host": vars["host"],
-        "username": USERNAME,
-        "port": int(vars.get("ssh_port", SSH_PORT)),  # per-device override
-        "timeout": COMMAND_TIMEOUT,
-        "global_delay_factor": 1,
-    }
-    if SSH_KEY:
-        params.update({"use_keys": True, "key_file": os.path.expanduser(SSH_KEY)})
-    else:
-        params["password"] = PASSWORD
-    return params
+    # ssh_port is a per-device override; YAML already gives us an int
+    return {**_BASE_PARAMS, "host": vars["host"], "port": vars.get("ssh_port") or SSH_PORT}
 
 def connect_from_vars(vars: dict):
     logger.debug("Connecting to %s:%s", vars["host"], vars.get("ssh_port", SSH_PORT))
+    from netmiko import ConnectHandler
     return ConnectHandler(**conn_params_from_vars(vars))
 
+def asyncssh_params_from_vars(vars: dict) -> dict:
+    return {**_ASYNCSSH_BASE_PARAMS, "host": vars["host"], "port": vars.get("ssh_port") or SSH_PORT}
+
+async def connect_async_from_vars(vars: dict):
+    # asyncssh is only needed for the asyncssh deploy backend
+    import asyncssh
+    logger.debug("Connecting (asyncssh) to %s:%s", vars["host"], vars.get("ssh_port", SSH_PORT))
+    return await asyncssh.connect(**asyncssh_params_from_vars(vars))
+
+# Several op-mode commands in one SSH round-trip: run them on a single line
+# with an echoed sentinel in between, then split the output back apart.
+CMD_SEP = "===SEP==="
+_CMD_SEP_LINE = re.compile(rf"^{CMD_SEP}[ \t]*\r?$", re.M)
+
+def batch_commands(cmds) -> str:
+    return f" ; echo {CMD_SEP} ; ".join(cmds)
+
+def split_batch_output(output: str, n: int) -> list[str]:
+    # Only whole sentinel lines count, so the echoed command line is ignored
+    parts = [p.strip("\r\n") for p in _CMD_SEP_LINE.split(output)]
+    return (parts + [""] * n)[:n]
+
+@functools.lru_cache(maxsize=None)
+def _templates() -> tuple:
+    # Templates are fixed for the life of the process: build the Environment
+    # and compile each template on first use (once per render worker), not
+    # per device.
+    from jinja2 import Environment, FileSystemLoader
+    try:
+        import markupsafe._speedups  # noqa: F401
+    except ImportError:
+        logger.warning("markupsafe C speedups not available; template rendering will be slower")
+    env = Environment(
+        loader=FileSystemLoader(str(TEMPLATES)),
+        trim_blocks=True,
+        lstrip_blocks=True,
+        autoescape=False,  # .set output is CLI text, never HTML
+        optimized=True,
+        auto_reload=False,  # no stat() freshness check on every get_template
+        cache_size=-1,
+    )
+    return tuple(
+        env.get_template(tpl)
+        for tpl in ("base_vyos.j2", "ospf_vyos.j2", "bgp_vyos.j2")
+        if (TEMPLATES / tpl).is_file()  # one stat per template, per process
+    )
+
 def render_device(name: str, vars: dict) -> pathlib.Path:
-    env = Environment(loader=FileSystemLoader(str(TEMPLATES)), trim_blocks=True, lstrip_blocks=True)
     ctx = {"inventory_hostname": name, **vars}
-    chunks = []
-    for tpl in ("base_vyos.j2", "ospf_vyos.j2", "bgp_vyos.j2"):
-        if (TEMPLATES / tpl).exists():
-            chunks.append(env.get_template(tpl).render(**ctx))
+    chunks = [tpl.render(**ctx) for tpl in _templates()]
     body = "\n".join([c.strip() for c in chunks if c]).strip() + "\n"
     out_file = OUT_DIR / f"{name}.set"
     out_file.write_text(body)
+    # Cleaned set-lines, so the deploy doesn't re-strip/filter the file per device
+    intended_set = frozenset(s for s in (l.strip() for l in body.splitlines()) if s and not s.startswith("#"))
+    intended_set_file(out_file).write_bytes(pickle.dumps(intended_set))
     logger.info("Rendered %s", out_file)
     return out_file
+
+def intended_set_file(intended_file: pathlib.Path) -> pathlib.Path:
+    return intended_file.with_suffix(".set.pickle")
+
+def load_intended_set(intended_file: pathlib.Path) -> frozenset:
+    return pickle.loads(intended_set_file(intended_file).read_bytes())
+
+# Pipeline stages. Each takes an already-open Netmiko connection so callers
+# can run several stages over one SSH session instead of reconnecting.
+
+VALIDATION_COMMANDS = [
+    "show ip ospf neighbor | no-more",
+    "show ip bgp summary | no-more",
+    "show ip route | match 0.0.0.0/0",
+]
+
+def fetch_running(conn) -> str:
+    return conn.send_command("show configuration commands", use_textfsm=False)
+
+def backup_stamp() -> str:
+    # Computed once per run by the caller and shared by every device's backup;
+    # device names already make the files unique within a run.
+    return datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+
+def save_backup(name: str, running_txt: str, stamp: str) -> pathlib.Path:
+    p = BACKUP_DIR / f"{name}.{stamp}.show"
+    # Write to a temp file and rename so a backup is never left half-written
+    tmp = p.with_suffix(".show.tmp")
+    tmp.write_bytes(running_txt.encode("utf-8"))
+    os.replace(tmp, p)
+    return p
+
+def read_intended(name: str) -> list[str]:
+    return [l.rstrip("\n") for l in (OUT_DIR / f"{name}.set").read_text().splitlines()]
+
+def compute_delta(running_set, intended: list[str]) -> list[str]:
+    """
+    Very simple desired-state delta:
+    - Push any 'set ...' lines that are in intended but not present in running.
+    - (Optional) For deletes, I could diff the other way and emit 'delete ...',
+      but for safety I keep this additive-only by default.
+    """
+    delta = []
+    for line in intended:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line not in running_set:
+            delta.append(line)
+    return delta
+
+# A whole delta as one VyOS script: configure, set-lines, commit, save.
+VYOS_SCRIPT_TEMPLATE = "source /opt/vyatta/etc/functions/script-template"
+STAGED_DELTA_DIR = "/tmp"
+
+def vyos_config_script(lines: list[str]) -> str:
+    return "\n".join([VYOS_SCRIPT_TEMPLATE, "configure", *lines, "commit", "save", "exit"]) + "\n"
+
+def staged_delta_path() -> str:
+    # Unique per push, so concurrent runs against one device can't collide
+    return f"{STAGED_DELTA_DIR}/netauto-delta-{os.getpid()}-{secrets.token_hex(4)}.sh"
+
+def _stage_file(conn, path: str, body: str):
+    # SFTP over the session Netmiko already has open (netmiko's own
+    # file_transfer has no VyOS driver)
+    import paramiko
+    sftp = paramiko.SFTPClient.from_transport(conn.remote_conn.get_transport())
+    try:
+        with sftp.open(path, "w") as f:
+            # Not world-readable in /tmp: set-lines may carry secrets
+            sftp.chmod(path, 0o600)
+            f.write(body)
+    finally:
+        sftp.close()
+
+def _push_lines(conn, lines: list[str]) -> str:
+    conn.config_mode()
+    out = conn.send_config_set(lines, exit_config_mode=False)
+    out += conn.send_command_timing("commit", strip_prompt=False, strip_command=False)
+    out += conn.send_command_timing("save", strip_prompt=False, strip_command=False)
+    conn.exit_config_mode()
+    return out
+
+def push_config(conn, lines: list[str]) -> str:
+    """
+    Upload the delta as a script and run it in one round-trip, instead of a
+    prompt round-trip per set-line. Falls back to line-by-line when the
+    device doesn't offer SFTP.
+    """
+    staged = staged_delta_path()
+    try:
+        _stage_file(conn, staged, vyos_config_script(lines))
+    except Exception as e:
+        logger.debug("Staging delta failed (%s); pushing line by line", e)
+        return _push_lines(conn, lines)
+    # commit can take a while on larger deltas
+    return conn.send_command(
+        f"vbash {staged} ; rm -f {staged}", use_textfsm=False, read_timeout=COMMAND_TIMEOUT * 4
+    )
+
+def run_validation(conn) -> tuple[bool, str]:
+    logs = []
+    ok = True
+    try:
+        # One round-trip for all checks instead of one per command
+        out = conn.send_command(
+            batch_commands(VALIDATION_COMMANDS), use_textfsm=False, read_timeout=COMMAND_TIMEOUT
+        )
+        ospf, bgp, default = split_batch_output(out, len(VALIDATION_COMMANDS))
+
+        logs.append(("show ip ospf neighbor", ospf))
+        # Soft check: if OSPF exists, I expect at least one 'Full' or NEIGHBOR header
+        if ("Full" not in ospf) and ("Neighbor ID" not in ospf):
+            pass
+
+        logs.append(("show ip bgp summary", bgp))
+        # Soft check: not all nodes run BGP; don't fail hard here
+
+        logs.append(("show ip route | match 0.0.0.0/0", default))
+        # Edge devices should display a default route; core may not.
+
+    except Exception as e:
+        ok = False
+        logs.append(("exception", str(e)))
+    rendered = "\n".join([f"\n$ {cmd}\n{txt}" for cmd, txt in logs])
+    return ok, rendered
+
+def run_pipeline(name: str, vars: dict, stamp: str, apply: bool = True) -> dict:
+    """
+    backup -> diff -> apply -> validate for one device over a single SSH
+    session. The running config fetched for the backup is reused for the diff.
+    """
+    result = {"name": name, "host": vars["host"], "backup": None, "delta": [],
+              "changed": False, "ok": True, "validation": ""}
+    conn = connect_from_vars(vars)
+    try:
+        running_txt = fetch_running(conn)
+        result["backup"] = save_backup(name, running_txt, stamp)
+
+        running_set = {l.rstrip() for l in running_txt.splitlines()}
+        result["delta"] = compute_delta(running_set, read_intended(name))
+
+        if apply and result["delta"]:
+            push_config(conn, result["delta"])
+            result["changed"] = True
+
+        result["ok"], result["validation"] = run_validation(conn)
+    finally:
+        conn.disconnect()
+    logger.info("Pipeline %s: %d delta lines, changed=%s, ok=%s",
+                name, len(result["delta"]), result["changed"], result["ok"])
+    return result
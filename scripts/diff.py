@@ -1,55 +1,144 @@
 #!/usr/bin/env python3
-"""Unified diff plus the exact delta lines that would be applied."""
+"""
+Intended-vs-running comparison plus the exact delta lines that would be applied.
+Set-lines are order-independent, so two set differences are enough; the full
+unified diff is only computed with --full-diff.
+Devices whose last commit hasn't changed since a clean diff against the same
+intended config are skipped without downloading their config (--force to
+always fetch).
+"""
 
-import pathlib
+import argparse
+import asyncio
 import sys
 import difflib
-from colorama import Fore, Style, init
-from common import load_inventory, connect, OUT_DIR
+import functools
+import hashlib
+import re
+from common import load_inventory, connect_from_vars, fetch_running, read_intended, compute_delta, OUT_DIR, CACHE_DIR
 
-init()
+@functools.lru_cache(maxsize=None)
+def _palette() -> tuple[str, str, str]:
+    """(green, red, reset); plain output when colorama isn't installed."""
+    try:
+        from colorama import Fore, Style, init
+    except ImportError:
+        return "", "", ""
+    init()
+    return Fore.GREEN, Fore.RED, Style.RESET_ALL
 
-def main():
-    devices = load_inventory()
-    any_changes = False
+def set_diff(running: list[str], intended: list[str]) -> tuple[list[str], list[str]]:
+    """(to_add, to_remove) in the original line order of each side."""
+    intended_set = {l.strip() for l in intended}
+    to_add = compute_delta(set(running), intended)
+    to_remove = [l for l in running if l and l not in intended_set]
+    return to_add, to_remove
 
-    for name, v in devices.items():
-        intended_p = OUT_DIR / f"{name}.set"
-        if not intended_p.exists():
-            print(f"[{name}] No generated config in {intended_p}. Run deploy_async.py --generate-only.")
-            continue
+def unified_lines(running: list[str], intended: list[str]) -> list[str]:
+    green, red, reset = _palette()
+    out = []
+    for line in difflib.unified_diff(running, intended, fromfile="running", tofile="intended", lineterm=""):
+        if line.startswith("+") and not line.startswith("+++"):
+            out.append(green + line + reset)
+        elif line.startswith("-") and not line.startswith("---"):
+            out.append(red + line + reset)
+        else:
+            out.append(line)
+    return out
+
+# e.g. "0   2024-01-01 12:00:00 by vyos via cli"
+_COMMIT_LINE = re.compile(r"^\d+\s+\d{4}-\d\d-\d\d \d\d:\d\d:\d\d")
+
+def commit_id(conn) -> str:
+    """
+    Newest entry of the device's commit history (a few bytes, not the config).
+    Anything that isn't a commit-log line (e.g. an error message) gives "",
+    which bypasses the cache.
+    """
+    out = conn.send_command("show system commit", use_textfsm=False)
+    for line in out.splitlines():
+        line = line.strip()
+        if line:
+            return line if _COMMIT_LINE.match(line) else ""
+    return ""
+
+def diff_device(name: str, conn, full_diff: bool = False, force: bool = False) -> tuple[bool, str]:
+    """
+    Running-vs-intended report for one device; True if they differ.
+    The report is returned rather than printed so concurrent devices don't
+    interleave their output.
+    """
+    out = [f"\n=== {name} ==="]
+
+    # The cache only ever records "in sync": last commit + intended file digest
+    cache_p = CACHE_DIR / f"{name}.commit_hash"
+    commit = commit_id(conn)
+    digest = hashlib.sha256((OUT_DIR / f"{name}.set").read_bytes()).hexdigest()
+    key = f"{commit}\n{digest}\n"
+    if commit and not force and cache_p.exists() and cache_p.read_text() == key:
+        out.append("No differences (cached).")
+        return False, "\n".join(out)
+
+    intended = read_intended(name)
+    # Same normalisation as deploy/run_pipeline; keep the list for ordered output
+    running = [l.rstrip() for l in fetch_running(conn).splitlines()]
 
-        intended = [l.rstrip("\n") for l in intended_p.read_text().splitlines()]
-        conn = connect(v["host"])
+    to_add, to_remove = set_diff(running, intended)
+    green, red, reset = _palette()
+    if not to_add and not to_remove:
+        if commit:
+            cache_p.write_text(key)
+        out.append("No differences.")
+        return False, "\n".join(out)
+    cache_p.unlink(missing_ok=True)
+
+    if full_diff:
+        out.extend(unified_lines(running, intended))
+
+    if to_remove:
+        out.append("\nOn device but not intended (left in place; deploy is additive-only):")
+        out.extend(red + f"- {l}" + reset for l in to_remove)
+    if to_add:
+        out.append("\nDelta to apply (set-lines not present on device):")
+        out.extend(green + f"+ {l}" + reset for l in to_add)
+    return True, "\n".join(out)
+
+def _diff_one(name: str, v: dict, full_diff: bool, force: bool) -> tuple[bool, str]:
+    # A failed device counts as changed (non-zero exit) but doesn't stop the others
+    try:
+        conn = connect_from_vars(v)
         try:
-            running_txt = conn.send_command("show configuration commands", use_textfsm=False)
+            return diff_device(name, conn, full_diff=full_diff, force=force)
         finally:
             conn.disconnect()
-        running = [l.rstrip("\n") for l in running_txt.splitlines()]
+    except Exception as e:
+        return True, f"[{name}] diff failed: {e}"
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare intended configs against running devices")
+    parser.add_argument("--full-diff", action="store_true", help="also print a unified diff with context")
+    parser.add_argument("--force", action="store_true", help="fetch full configs even if the commit is unchanged")
+    parser.add_argument("--rebuild-cache", action="store_true",
+                        help="drop the cached inventory and reload the source file")
+    args = parser.parse_args()
+
+    devices = load_inventory(rebuild_cache=args.rebuild_cache)
+    any_changes = False
 
-        diff = list(difflib.unified_diff(running, intended, fromfile="running", tofile="intended", lineterm=""))
-        print(f"\n=== {name} ===")
-        if not diff:
-            print("No differences.")
+    # All devices are fetched concurrently (Netmiko in worker threads)
+    tasks = []
+    for name, v in devices.items():
+        intended_p = OUT_DIR / f"{name}.set"
+        if not intended_p.exists():
+            print(f"[{name}] No generated config in {intended_p}. Run deploy_async.py --generate-only.")
             continue
+        tasks.append(asyncio.to_thread(_diff_one, name, v, args.full_diff, args.force))
 
-        any_changes = True
-        for line in diff:
-            if line.startswith("+") and not line.startswith("+++"):
-                print(Fore.GREEN + line + Style.RESET_ALL)
-            elif line.startswith("-") and not line.startswith("---"):
-                print(Fore.RED + line + Style.RESET_ALL)
-            else:
-                print(line)
-
-        # Show delta that would be pushed
-        running_set = set(running)
-        delta = [l for l in intended if l and not l.startswith("#") and l not in running_set]
-        if delta:
-            print("\nDelta to apply (set-lines not present on device):")
-            for l in delta:
-                print(Fore.GREEN + f"+ {l}" + Style.RESET_ALL)
+    for fut in asyncio.as_completed(tasks):
+        changed, report = await fut
+        print(report)
+        any_changes = changed or any_changes
     return 0 if not any_changes else 1
 
 if __name__ == "__main__":
-    sys.exit(main())
+    sys.exit(asyncio.run(main()))
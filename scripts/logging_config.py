@@ -1,9 +1,20 @@
 #!/usr/bin/env python3
+import atexit
+import contextlib
 import logging
 import logging.handlers
+import multiprocessing
 import os
+import queue
 from pathlib import Path
 
+# Our formats never use thread/process info or caller file/line, so skip
+# collecting them for every record.
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
+logging._srcfile = None
+
 def setup_logging(log_dir: Path, level_str: str = "INFO") -> logging.Logger:
     log_dir.mkdir(exist_ok=True)
     level = getattr(logging, level_str.upper(), logging.INFO)
@@ -13,6 +24,10 @@ def setup_logging(log_dir: Path, level_str: str = "INFO") -> logging.Logger:
     logger.propagate = False  # avoid double logs
 
     # Clear any existing handlers (idempotent runs)
+    old = getattr(logger, "listener", None)
+    if old is not None:
+        old.stop()
+        atexit.unregister(old.stop)
     logger.handlers.clear()
 
     # File: rotate at 5MB, keep 5 files
@@ -29,6 +44,35 @@ def setup_logging(log_dir: Path, level_str: str = "INFO") -> logging.Logger:
     console_h.setLevel(level)
     console_h.setFormatter(logging.Formatter("%(levelname)s: %(message)s"))
 
-    logger.addHandler(file_h)
-    logger.addHandler(console_h)
+    # Callers only enqueue records; formatting and file/console I/O happen on
+    # the listener's background thread, so deploy workers never block on disk.
+    q = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(q, file_h, console_h, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.listener = listener
+
+    logger.addHandler(logging.handlers.QueueHandler(q))
     return logger
+
+@contextlib.contextmanager
+def worker_log_queue(logger: logging.Logger):
+    """
+    Yield a multiprocessing queue for worker processes (see worker_logging).
+    RotatingFileHandler is not safe across processes, so workers only enqueue
+    and this process writes their records through the same handlers.
+    """
+    q = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(q, *logger.listener.handlers, respect_handler_level=True)
+    listener.start()
+    try:
+        yield q
+    finally:
+        listener.stop()
+        q.close()
+        q.join_thread()
+
+def worker_logging(q) -> None:
+    # Pool initializer: drop the inherited handlers, whose queue belongs to
+    # the parent's listener thread, and hand records back to the parent
+    logging.getLogger("netauto").handlers[:] = [logging.handlers.QueueHandler(q)]
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+backup -> diff -> apply -> validate per device over one SSH session,
+instead of each standalone script reconnecting for its own stage.
+"""
+
+import argparse
+import sys
+from common import load_inventory, run_pipeline, backup_stamp, OUT_DIR
+
+def main():
+    parser = argparse.ArgumentParser(description="Run all stages over one connection per device")
+    parser.add_argument("--dry-run", action="store_true", help="backup, diff and validate only; push nothing")
+    parser.add_argument("--rebuild-cache", action="store_true",
+                        help="drop the cached inventory and reload the source file")
+    args = parser.parse_args()
+
+    devices = load_inventory(rebuild_cache=args.rebuild_cache)
+    stamp = backup_stamp()
+    overall_ok = True
+    for name, v in devices.items():
+        if not (OUT_DIR / f"{name}.set").exists():
+            print(f"[{name}] No generated config in {OUT_DIR}. Run deploy_async.py --generate-only.")
+            continue
+        try:
+            res = run_pipeline(name, v, stamp, apply=not args.dry_run)
+        except Exception as e:
+            print(f"[{name}] pipeline failed: {e}")
+            overall_ok = False
+            continue
+        print(f"\n=== {name} ({v['host']}) ===")
+        print(f"backup: {res['backup']}")
+        print(f"delta: {len(res['delta'])} lines ({'applied' if res['changed'] else 'not applied'})")
+        print(res["validation"])
+        overall_ok = overall_ok and res["ok"]
+    return 0 if overall_ok else 2
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,45 +3,42 @@
 Post-deploy validation with clear PASS/FAIL and non-zero exit on failure.
 """
 
+import argparse
+import asyncio
 import sys
-from common import load_inventory, connect
+from common import load_inventory, connect_from_vars, run_validation
 
-def check_device(name, host) -> tuple[bool, list[str]]:
-    conn = connect(host)
-    logs = []
-    ok = True
-    try:
-        out = conn.send_command("show ip ospf neighbor | no-more", use_textfsm=False)
-        logs.append(("show ip ospf neighbor", out))
-        # Soft check: if OSPF exists, I expect at least one 'Full' or NEIGHBOR header
-        if ("Full" not in out) and ("Neighbor ID" not in out):
-            pass
-
-        out = conn.send_command("show ip bgp summary | no-more", use_textfsm=False)
-        logs.append(("show ip bgp summary", out))
-        # Soft check: not all nodes run BGP; don't fail hard here
-
-        out = conn.send_command("show ip route | match 0.0.0.0/0", use_textfsm=False)
-        logs.append(("show ip route | match 0.0.0.0/0", out))
-        # Edge devices should display a default route; core may not.
+def check_device(conn) -> tuple[bool, str]:
+    return run_validation(conn)
 
+def _check_one(name: str, v: dict) -> tuple[bool, str]:
+    try:
+        conn = connect_from_vars(v)
     except Exception as e:
-        ok = False
-        logs.append(("exception", str(e)))
-    finally:
-        conn.disconnect()
-    rendered = "\n".join([f"\n$ {cmd}\n{txt}" for cmd, txt in logs])
-    return ok, rendered
+        ok, txt = False, f"\n$ connect\n{e}"
+    else:
+        try:
+            ok, txt = check_device(conn)
+        finally:
+            conn.disconnect()
+    return ok, f"\n=== {name} ({v['host']}) ===\n{txt}"
+
+async def main():
+    # Devices are checked concurrently (Netmiko in worker threads) and
+    # reported as each one finishes.
+    parser = argparse.ArgumentParser(description="Post-deploy validation")
+    parser.add_argument("--rebuild-cache", action="store_true",
+                        help="drop the cached inventory and reload the source file")
+    args = parser.parse_args()
 
-def main():
-    devices = load_inventory()
+    devices = load_inventory(rebuild_cache=args.rebuild_cache)
     overall_ok = True
-    for name, v in devices.items():
-        ok, txt = check_device(name, v["host"])
-        print(f"\n=== {name} ({v['host']}) ===")
+    tasks = [asyncio.to_thread(_check_one, name, v) for name, v in devices.items()]
+    for fut in asyncio.as_completed(tasks):
+        ok, txt = await fut
         print(txt)
         overall_ok = overall_ok and ok
     return 0 if overall_ok else 2
 
 if __name__ == "__main__":
-    sys.exit(main())
+    sys.exit(asyncio.run(main()))
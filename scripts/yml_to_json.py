@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Export inventory/lab.yml to inventory/lab.json. While the JSON file is
+strictly newer than the YAML, load_inventory reads it with the stdlib C JSON
+parser and never touches PyYAML.
+"""
+
+import json
+import sys
+from common import INV_FILE, INV_JSON, parse_inventory_yaml
+
+def main():
+    devices = parse_inventory_yaml(INV_FILE)
+    # The export replaces lab.yml while it is newer, so it must load back
+    # exactly: JSON would silently turn e.g. int mapping keys into strings.
+    try:
+        blob = json.dumps({"devices": devices}, indent=2)
+    except (TypeError, ValueError) as e:
+        print(f"Not exporting {INV_FILE}: {e}", file=sys.stderr)
+        return 1
+    if json.loads(blob)["devices"] != devices:
+        print(f"Not exporting {INV_FILE}: it does not round-trip through JSON "
+              "(non-string mapping keys?)", file=sys.stderr)
+        return 1
+    tmp = INV_JSON.with_suffix(".json.tmp")
+    tmp.write_text(blob + "\n")
+    tmp.replace(INV_JSON)
+    print(f"Wrote {len(devices)} devices from {INV_FILE} to {INV_JSON}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
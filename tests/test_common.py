@@ -0,0 +1,140 @@
+import json
+from common import (
+    CMD_SEP, INV_CACHE,
+    batch_commands, compute_delta, load_inventory, push_config, split_batch_output,
+)
+
+def test_batch_roundtrip():
+    cmd = batch_commands(["show a", "show b", "show c"])
+    assert cmd == f"show a ; echo {CMD_SEP} ; show b ; echo {CMD_SEP} ; show c"
+    # device echoes the command line (contains the sentinel inline) before output
+    out = f"{cmd}\nA1\nA2\n{CMD_SEP}\nB1\n{CMD_SEP}\r\n\n"
+    assert split_batch_output(out, 3) == [f"{cmd}\nA1\nA2", "B1", ""]
+
+def test_split_pads_missing_sections():
+    assert split_batch_output("only", 3) == ["only", "", ""]
+
+def test_compute_delta_is_additive_only():
+    running = {"set a", "set stale"}
+    intended = ["# Base", "set a", "", "  set b  "]
+    assert compute_delta(running, intended) == ["set b"]
+
+def test_inventory_json_cache_matches_yaml():
+    devices = load_inventory(rebuild_cache=True)
+    assert json.loads(INV_CACHE.read_text())["devices"] == devices
+
+class FakeConn:
+    """Netmiko stand-in without a paramiko transport, so SFTP staging fails."""
+
+    def __init__(self):
+        self.sent = []
+
+    def config_mode(self):
+        self.sent.append("configure")
+
+    def send_config_set(self, lines, **kwargs):
+        self.sent.extend(lines)
+        return ""
+
+    def send_command_timing(self, cmd, **kwargs):
+        self.sent.append(cmd)
+        return ""
+
+    def exit_config_mode(self):
+        self.sent.append("exit")
+
+def test_push_config_falls_back_to_line_by_line():
+    conn = FakeConn()
+    push_config(conn, ["set a", "set b"])
+    assert conn.sent == ["configure", "set a", "set b", "commit", "save", "exit"]
+    assert not any("vbash" in c for c in conn.sent)
+
+def test_push_config_runs_staged_script_in_one_command(monkeypatch):
+    import common
+    staged = {}
+    monkeypatch.setattr(common, "_stage_file", lambda conn, path, body: staged.update({path: body}))
+
+    class StagingConn:
+        def __init__(self):
+            self.sent = []
+
+        def send_command(self, cmd, **kwargs):
+            self.sent.append(cmd)
+            return ""
+
+    conn = StagingConn()
+    push_config(conn, ["set a", "set b"])
+    ((path, body),) = staged.items()
+    assert path.startswith("/tmp/netauto-delta-") and path.endswith(".sh")
+    assert body.splitlines()[1:] == ["configure", "set a", "set b", "commit", "save", "exit"]
+    assert conn.sent == [f"vbash {path} ; rm -f {path}"]
+
+    push_config(StagingConn(), ["set a"])
+    assert len(staged) == 2  # a fresh path per push
+
+def test_staged_file_is_private_before_the_delta_is_written(monkeypatch):
+    import contextlib
+    import types
+    import paramiko
+    import common
+    events = []
+
+    class FakeSFTP:
+        @contextlib.contextmanager
+        def open(self, path, mode):
+            events.append(("open", path))
+            yield types.SimpleNamespace(write=lambda body: events.append(("write", body)))
+
+        def chmod(self, path, mode):
+            events.append(("chmod", oct(mode)))
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(paramiko.SFTPClient, "from_transport", lambda transport: FakeSFTP())
+    conn = types.SimpleNamespace(remote_conn=types.SimpleNamespace(get_transport=lambda: None))
+    common._stage_file(conn, "/tmp/x.sh", "set secret\n")
+    assert events == [("open", "/tmp/x.sh"), ("chmod", "0o600"), ("write", "set secret\n")]
+
+def test_newer_json_inventory_is_preferred(tmp_path, monkeypatch):
+    import os
+    import common
+    yml, js = tmp_path / "lab.yml", tmp_path / "lab.json"
+    yml.write_text("devices:\n  Y1: {host: 192.0.2.1}\n")
+    js.write_text(json.dumps({"devices": {"J1": {"host": "192.0.2.2"}}}))
+    monkeypatch.setattr(common, "INV_FILE", yml)
+    monkeypatch.setattr(common, "INV_JSON", js)
+    monkeypatch.setattr(common, "INV_CACHE", tmp_path / "inventory.json")
+
+    os.utime(js, ns=(yml.stat().st_mtime_ns + 10**9,) * 2)
+    assert list(common.load_inventory()) == ["J1"]
+
+    os.utime(yml, ns=(js.stat().st_mtime_ns + 10**9,) * 2)
+    assert list(common.load_inventory()) == ["Y1"]
+
+    os.utime(js, ns=(yml.stat().st_mtime_ns,) * 2)  # e.g. a fresh checkout
+    assert list(common.load_inventory()) == ["Y1"]
+
+def test_unserializable_inventory_still_loads(tmp_path, monkeypatch):
+    import common
+    yml = tmp_path / "lab.yml"
+    yml.write_text("devices:\n  R1: {host: 192.0.2.1, commissioned: 2024-01-01}\n")
+    monkeypatch.setattr(common, "INV_FILE", yml)
+    monkeypatch.setattr(common, "INV_JSON", tmp_path / "lab.json")
+    monkeypatch.setattr(common, "INV_CACHE", tmp_path / "inventory.json")
+
+    assert common.load_inventory()["R1"]["host"] == "192.0.2.1"
+    assert not (tmp_path / "inventory.json").exists()
+
+def test_int_keyed_inventory_is_not_cached(tmp_path, monkeypatch):
+    import common
+    yml = tmp_path / "lab.yml"
+    yml.write_text("devices:\n  R1: {host: 192.0.2.1, vlans: {10: {name: a}}}\n")
+    monkeypatch.setattr(common, "INV_FILE", yml)
+    monkeypatch.setattr(common, "INV_JSON", tmp_path / "lab.json")
+    monkeypatch.setattr(common, "INV_CACHE", tmp_path / "inventory.json")
+
+    assert common.load_inventory()["R1"]["vlans"] == {10: {"name": "a"}}
+    assert not (tmp_path / "inventory.json").exists()
+    common._load.cache_clear()  # as in a fresh process
+    assert common.load_inventory()["R1"]["vlans"] == {10: {"name": "a"}}
@@ -0,0 +1,172 @@
+import deploy_async
+from common import load_inventory
+
+def test_generate_all_pool_matches_inline(monkeypatch):
+    devs = load_inventory()
+
+    monkeypatch.setattr(deploy_async, "RENDER_POOL_MIN_DEVICES", len(devs) + 1)
+    inline = deploy_async.generate_all(devs)
+    inline_text = {n: p.read_text() for n, p in inline.items()}
+
+    monkeypatch.setattr(deploy_async, "RENDER_POOL_MIN_DEVICES", 1)
+    pooled = deploy_async.generate_all(devs)
+    assert pooled == inline
+    assert {n: p.read_text() for n, p in pooled.items()} == inline_text
+
+def test_render_workers_log_through_the_parent(monkeypatch):
+    import logging
+    from common import logger
+    records = []
+
+    class Capture(logging.Handler):
+        def emit(self, record):
+            records.append(record.getMessage())
+
+    # Stands in for the file/console handlers: only the parent's listener
+    # may write to them
+    monkeypatch.setattr(logger.listener, "handlers", (Capture(),))
+    monkeypatch.setattr(deploy_async, "RENDER_POOL_MIN_DEVICES", 1)
+    written = deploy_async.generate_all(load_inventory())
+    assert sorted(records) == sorted(f"Rendered {p}" for p in written.values())
+
+class FakeSession:
+    """Stand-in for AsyncSSHSession/NetmikoSession."""
+    running = "set system host-name R2\n"
+    pushed = []
+
+    @classmethod
+    async def open(cls, vars):
+        return cls()
+
+    async def send_command(self, cmd):
+        return self.running
+
+    async def send_commands(self, cmds):
+        return [""] * len(cmds)
+
+    async def send_config(self, lines):
+        FakeSession.pushed.append(lines)
+        return ""
+
+    async def close(self):
+        pass
+
+def test_deploy_all_pushes_only_missing_lines(monkeypatch):
+    import asyncio
+    from common import render_device
+    devs = load_inventory()
+    written = {"R2": render_device("R2", devs["R2"])}
+    monkeypatch.setattr(FakeSession, "pushed", [])
+
+    (res,) = asyncio.run(deploy_async.deploy_all({"R2": devs["R2"]}, written, FakeSession, 2, "test"))
+    assert (res.name, res.changed, res.ok) == ("R2", True, True)
+    (delta,) = FakeSession.pushed
+    assert "set system host-name R2" not in delta
+    assert "set interfaces loopback lo address 2.2.2.2/32" in delta
+
+class FakeAsyncSSHConn:
+    async def run(self, cmd, **kwargs):
+        from types import SimpleNamespace
+        return SimpleNamespace(exit_status=1, stdout="", stderr="Invalid command")
+
+def test_failed_running_config_fetch_pushes_nothing(monkeypatch):
+    import asyncio
+    from common import render_device
+    devs = load_inventory()
+    written = {"R2": render_device("R2", devs["R2"])}
+
+    class BrokenSession(deploy_async.AsyncSSHSession):
+        @classmethod
+        async def open(cls, vars):
+            return cls(FakeAsyncSSHConn())
+
+        async def send_config(self, lines):
+            raise AssertionError("must not push")
+
+        async def close(self):
+            pass
+
+    (res,) = asyncio.run(deploy_async.deploy_all({"R2": devs["R2"]}, written, BrokenSession, 2, "test"))
+    assert not res.ok and not res.changed
+    assert "Invalid command" in res.message
+
+class StalledAsyncSSHConn:
+    """Never answers; like asyncssh, run() only gives up when given a timeout."""
+    async def run(self, cmd, timeout=None, **kwargs):
+        import asyncio
+        await asyncio.wait_for(asyncio.Event().wait(), timeout)
+
+def test_stalled_device_times_out_and_frees_its_slot(monkeypatch):
+    import asyncio
+    from common import render_device
+    devs = load_inventory()
+    written = {n: render_device(n, devs[n]) for n in ("R1", "R2")}
+    monkeypatch.setattr(deploy_async, "COMMAND_TIMEOUT", 0.05)
+
+    class StalledSession(deploy_async.AsyncSSHSession):
+        @classmethod
+        async def open(cls, vars):
+            return cls(StalledAsyncSSHConn())
+
+        async def close(self):
+            pass
+
+    subset = {n: devs[n] for n in written}
+    results = asyncio.run(asyncio.wait_for(
+        deploy_async.deploy_all(subset, written, StalledSession, 1, "test"), timeout=5
+    ))
+    assert [(r.name, r.ok, r.changed) for r in results] == [("R1", False, False), ("R2", False, False)]
+
+class FakeSFTP:
+    def __init__(self, files):
+        self.files = files
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def open(self, path, mode):
+        files = self.files
+
+        class Handle:
+            async def __aenter__(self):
+                files[path] = {"mode": None, "body": ""}
+                return self
+
+            async def __aexit__(self, *exc):
+                pass
+
+            async def write(self, data):
+                assert files[path]["mode"] == 0o600, "delta written before chmod"
+                files[path]["body"] += data
+
+        return Handle()
+
+    async def chmod(self, path, mode):
+        self.files[path]["mode"] = mode
+
+def test_asyncssh_send_config_runs_a_staged_script():
+    import asyncio
+    from types import SimpleNamespace
+
+    class StagingConn:
+        def __init__(self):
+            self.files, self.runs = {}, []
+
+        def start_sftp_client(self):
+            return FakeSFTP(self.files)
+
+        async def run(self, cmd, **kwargs):
+            self.runs.append((cmd, kwargs))
+            return SimpleNamespace(exit_status=0, stdout="", stderr="")
+
+    conn = StagingConn()
+    asyncio.run(deploy_async.AsyncSSHSession(conn).send_config(["set a", "set b"]))
+    ((path, staged),) = conn.files.items()
+    assert path.startswith("/tmp/netauto-delta-") and path.endswith(".sh")
+    assert staged["body"].splitlines()[1:] == ["configure", "set a", "set b", "commit", "save", "exit"]
+    ((cmd, kwargs),) = conn.runs
+    assert cmd.startswith(f"vbash {path} ;") and f"rm -f {path}" in cmd
+    assert "input" not in kwargs and kwargs["timeout"] == deploy_async.COMMAND_TIMEOUT * 4
@@ -0,0 +1,79 @@
+from diff import set_diff
+
+def test_set_diff_ignores_order_and_comments():
+    running = ["set b", "set a", "set old"]
+    intended = ["# Base", "set a", "", "set b", "set c"]
+    to_add, to_remove = set_diff(running, intended)
+    assert to_add == ["set c"]
+    assert to_remove == ["set old"]
+
+COMMIT_LOG = "0   2024-01-01 12:00:00 by vyos via cli\n1   2023-12-31 09:00:00 by vyos via cli\n"
+
+class FakeConn:
+    def __init__(self, running, commits=COMMIT_LOG):
+        self.running = running
+        self.commits = commits
+        self.sent = []
+
+    def send_command(self, cmd, **kwargs):
+        self.sent.append(cmd)
+        if cmd == "show system commit":
+            return self.commits
+        return self.running
+
+def test_unchanged_commit_skips_config_download(tmp_path, monkeypatch):
+    import diff
+    from common import OUT_DIR
+    monkeypatch.setattr(diff, "CACHE_DIR", tmp_path)
+    if not (OUT_DIR / "R1.set").exists():
+        return
+    in_sync = (OUT_DIR / "R1.set").read_text()
+
+    changed, _ = diff.diff_device("R1", FakeConn(in_sync))
+    assert not changed
+
+    conn = FakeConn(in_sync)
+    changed, report = diff.diff_device("R1", conn)
+    assert not changed and "(cached)" in report
+    assert conn.sent == ["show system commit"]
+
+    conn = FakeConn(in_sync)
+    diff.diff_device("R1", conn, force=True)
+    assert "show configuration commands" in conn.sent
+
+def test_commit_command_error_bypasses_cache(tmp_path, monkeypatch):
+    import diff
+    from common import OUT_DIR
+    monkeypatch.setattr(diff, "CACHE_DIR", tmp_path)
+    if not (OUT_DIR / "R1.set").exists():
+        return
+    in_sync = (OUT_DIR / "R1.set").read_text()
+    error = "\n  Invalid command: show system [commit]\n"
+
+    changed, _ = diff.diff_device("R1", FakeConn(in_sync, commits=error))
+    assert not changed
+    assert not (tmp_path / "R1.commit_hash").exists()
+
+    drifted = "\n".join(l for l in in_sync.splitlines() if "ospf" not in l)
+    changed, report = diff.diff_device("R1", FakeConn(drifted, commits=error))
+    assert changed and "(cached)" not in report
+
+def test_unreachable_device_is_reported_not_raised(monkeypatch):
+    import diff
+
+    def boom(v):
+        raise OSError(f"unreachable {v['host']}")
+    monkeypatch.setattr(diff, "connect_from_vars", boom)
+    assert diff._diff_one("R1", {"host": "192.0.2.1"}, False, False) == (
+        True, "[R1] diff failed: unreachable 192.0.2.1"
+    )
+
+def test_trailing_whitespace_on_device_is_not_drift(tmp_path, monkeypatch):
+    import diff
+    from common import OUT_DIR
+    monkeypatch.setattr(diff, "CACHE_DIR", tmp_path)
+    if not (OUT_DIR / "R1.set").exists():
+        return
+    padded = "\n".join(l + "  " for l in (OUT_DIR / "R1.set").read_text().splitlines())
+    changed, _ = diff.diff_device("R1", FakeConn(padded), force=True)
+    assert not changed
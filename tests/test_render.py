@@ -1,5 +1,5 @@
 import pathlib
-from common import load_inventory, render_device, OUT_DIR
+from common import load_inventory, load_intended_set, render_device, OUT_DIR
 
 def test_render_all():
     devs = load_inventory()
@@ -16,3 +16,21 @@ def test_r1_contains_expected_networks():
         return
     text = p.read_text()
     assert "10.10.10.0/24" in text
+
+def test_inventory_parsed_once():
+    assert load_inventory() is load_inventory()
+
+def test_render_writes_intended_set():
+    devs = load_inventory()
+    p = render_device("R1", devs["R1"])
+    intended = load_intended_set(p)
+    assert "set system host-name R1" in intended
+    assert not any(l.startswith("#") or not l for l in intended)
+
+def test_templates_resolved_once(monkeypatch):
+    import common
+    devs = load_inventory()
+    render_device("R1", devs["R1"])
+    # Further renders must not touch the templates directory at all
+    monkeypatch.setattr(common, "TEMPLATES", pathlib.Path("/nonexistent"))
+    assert "set system host-name R2" in render_device("R2", devs["R2"]).read_text()